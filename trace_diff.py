@@ -11,91 +11,538 @@ Usage:
     python trace_diff.py --help
 """
 
+import os
 import sys
 import json
+import mmap
+import multiprocessing
 import re
 import argparse
+import functools
+import gc
+import struct
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from array import array
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from itertools import count, islice, zip_longest
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
+# Optional faster JSON backends; the stdlib json module is always the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-@dataclass
+try:
+    # numpy vectorises the trace diff; it is also required by numba
+    import numpy as np
+except ImportError:
+    np = None
+
+# numba JIT-compiles the standard-format decoder; it is imported by
+# _std_decoder() on first use since the import alone costs over half a second
+numba = None
+
+try:
+    # ijson picks its fastest available backend (yajl2_c when installed) on import
+    import ijson
+except ImportError:
+    ijson = None
+
+
+# Format: A: 01 F: B0 B: 00 C: 13 D: 00 E: D8 H: 01 L: 4D SP: FFFE PC: 00:0100 (00 C3 13 02)
+_STD_PATTERN = r'A: ([0-9A-F]{2}) F: ([0-9A-F]{2}) B: ([0-9A-F]{2}) C: ([0-9A-F]{2}) D: ([0-9A-F]{2}) E: ([0-9A-F]{2}) H: ([0-9A-F]{2}) L: ([0-9A-F]{2}) SP: ([0-9A-F]{4}) PC: 00:([0-9A-F]{4}) \(([0-9A-F]{2}) ([0-9A-F]{2}) ([0-9A-F]{2}) ([0-9A-F]{2})\)'
+
+# Anchored at every line start so a whole file can be scanned in one call
+_STD_RE = re.compile(r'(?m)^[ \t]*' + _STD_PATTERN)
+_STD_BYTES_RE = re.compile(rb'(?m)^[ \t]*' + _STD_PATTERN.encode())
+_STD_LINE_LEN = 82
+
+# Canonical rendering of a standard line's registers and memory; a line the
+# regex accepts re-renders to exactly its first _STD_LINE_LEN characters
+_STD_REG_FORMAT = 'A: %02X F: %02X B: %02X C: %02X D: %02X E: %02X H: %02X L: %02X SP: %04X PC: 00:%04X'
+_STD_MEM_FORMAT = ' (%02X %02X %02X %02X)'
+_STD_REG_LEN = 68
+
+# Checks the memory field without decoding it, for skip_memory
+_STD_MEM_RE = re.compile(r' \([0-9A-F]{2} [0-9A-F]{2} [0-9A-F]{2} [0-9A-F]{2}\)')
+
+# Unpacks every hex digit pair of a line (A-L, SP and PC as two pairs each,
+# then the memory bytes) as one big-endian word (c0 << 8) | c1
+_STD_WORDS = struct.Struct('>3xH4xH4xH4xH4xH4xH4xH4xH5xHH8xHH2xH1xH1xH1xH')
+# The same without the memory bytes, whose place in a record is zero-filled
+_STD_REG_WORDS = struct.Struct('>3xH4xH4xH4xH4xH4xH4xH4xH5xHH8xHH')
+_ZERO_MEMORY = bytes(4)
+
+# Maps a two-character hex word (c0 << 8) | c1 straight to its byte value;
+# anything that is not a pair of hex digits maps to 0
+_HEX2 = bytearray(65536)
+for _hi in b'0123456789ABCDEFabcdef':
+    for _lo in b'0123456789ABCDEFabcdef':
+        _HEX2[(_hi << 8) | _lo] = int(bytes((_hi, _lo)), 16)
+del _hi, _lo
+
+if np is not None:
+    # Standard line layout for the JIT decoder: 'x' marks a hex digit
+    _STD_TEMPLATE = np.frombuffer(
+        b'A: xx F: xx B: xx C: xx D: xx E: xx H: xx L: xx SP: xxxx PC: 00:xxxx (xx xx xx xx)',
+        dtype=np.uint8
+    )
+    # Column of every hex digit pair, in the same order as _STD_WORDS
+    _HEX_OFFSETS = np.array([3, 9, 15, 21, 27, 33, 39, 45, 52, 54, 64, 66, 70, 73, 76, 79], dtype=np.int64)
+    # Value of a single hex digit; 0xFF for anything the regex would reject
+    _NIBBLE = np.full(256, 0xFF, dtype=np.uint8)
+    for _i, _c in enumerate(b'0123456789ABCDEF'):
+        _NIBBLE[_c] = _i
+    del _i, _c
+
+
+def _parse_std_buffer(buf, line_starts, template, nibble, offsets):
+    """Validate and decode every line of buf into 16-byte records.
+    
+    Compiled by _std_decoder(); never called as plain Python.
+    """
+    n = len(line_starts)
+    width = len(template)
+    records = np.zeros((n, 16), dtype=np.uint8)
+    valid = np.zeros(n, dtype=np.bool_)
+    for i in numba.prange(n):
+        s = line_starts[i]
+        while s < len(buf) and (buf[s] == 32 or buf[s] == 9):
+            s += 1
+        if s + width > len(buf):
+            continue
+        ok = True
+        for k in range(width):
+            c = buf[s + k]
+            if template[k] == 120:
+                if nibble[c] == 0xFF:
+                    ok = False
+                    break
+            elif c != template[k]:
+                ok = False
+                break
+        if ok:
+            for j in range(len(offsets)):
+                o = s + offsets[j]
+                records[i, j] = (nibble[buf[o]] << 4) | nibble[buf[o + 1]]
+            valid[i] = True
+    return records, valid
+
+
+@functools.cache
+def _std_decoder():
+    """Import numba and compile _parse_std_buffer, or return None without it."""
+    global numba
+    if np is None:
+        return None
+    try:
+        import numba
+    except ImportError:
+        return None
+    decoder = numba.njit(parallel=True, nogil=True, cache=True)(_parse_std_buffer)
+    # Compile here on a throwaway buffer, then collect the compiler's frame
+    # cycles; they reach the caller's frames and would keep a trace's mmap
+    # exported past the point where it is closed
+    decoder(_STD_TEMPLATE, np.zeros(1, dtype=np.int64), _STD_TEMPLATE, _NIBBLE, _HEX_OFFSETS)
+    gc.collect()
+    return decoder
+
+
+def _jit_decodes(size: int) -> bool:
+    """Whether a standard trace of this many bytes goes through the numba decoder."""
+    return size >= _JIT_PARSE_THRESHOLD and _std_decoder() is not None
+
+
+# Standard traces smaller than this are decoded without numba: its import
+# and parallel runtime startup only pay off from around 8 MB, so below
+# 16 MB the lookup-table decoder (with overlapped loading) is as fast or faster
+_JIT_PARSE_THRESHOLD = 16 * 1024 * 1024
+
+# Standard traces at least this large are decoded in parallel worker
+# processes when the numba decoder is unavailable
+_PARALLEL_PARSE_THRESHOLD = 16 * 1024 * 1024
+
+# Rows per block when scanning two traces for differences without numpy
+_DIFF_BLOCK = 4096
+
+# Pending output lines after which streaming comparison writes them out
+_OUTPUT_FLUSH_LINES = 10000
+
+# Shared result for states that match, so the common case allocates nothing
+_NO_DIFFERENCES: Tuple[str, ...] = ()
+
+# JSON traces larger than this are streamed with ijson rather than loaded whole
+_JSON_STREAM_THRESHOLD = 100 * 1024 * 1024
+
+
+@dataclass(slots=True, frozen=True)
 class CPUState:
-    """Represents the CPU state at a single instruction."""
+    """Represents the CPU state at a single instruction.
+    
+    Registers are stored as integers and only formatted as hex for output.
+    memory is None when the trace was parsed with skip_memory.
+    """
     instruction_num: int
-    a: str
-    f: str
-    b: str
-    c: str
-    d: str
-    e: str
-    h: str
-    l: str
-    sp: str
-    pc: str
-    memory: List[str]
+    a: int
+    f: int
+    b: int
+    c: int
+    d: int
+    e: int
+    h: int
+    l: int
+    sp: int
+    pc: int
+    memory: Optional[bytes]
+
+
+class Trace:
+    """Struct-of-arrays storage for a parsed trace.
+    
+    Each register is kept in its own compact array of integers rather than as
+    one CPUState per instruction; the four memory bytes are packed into a
+    single 32-bit value per instruction, or not kept at all with skip_memory.
+    """
+    
+    BYTE_REGISTERS = ('a', 'f', 'b', 'c', 'd', 'e', 'h', 'l')
+    COLUMNS = BYTE_REGISTERS + ('sp', 'pc', 'memory')
+    
+    def __init__(self, skip_memory: bool = False):
+        self.instruction_nums = array('q')
+        for reg in self.BYTE_REGISTERS:
+            setattr(self, reg, array('B'))
+        self.sp = array('H')
+        self.pc = array('H')
+        self.memory = None if skip_memory else array('I')
+    
+    def __len__(self) -> int:
+        return len(self.pc)
+    
+    def __getitem__(self, i: int) -> CPUState:
+        """Rebuild the CPUState for a single instruction."""
+        return CPUState(
+            instruction_num=self.instruction_nums[i],
+            a=self.a[i], f=self.f[i], b=self.b[i], c=self.c[i],
+            d=self.d[i], e=self.e[i], h=self.h[i], l=self.l[i],
+            sp=self.sp[i], pc=self.pc[i],
+            memory=self.memory[i].to_bytes(4, 'big') if self.memory is not None else None
+        )
+    
+    def append(self, state: CPUState) -> None:
+        """Append a CPUState to the columns."""
+        self.instruction_nums.append(state.instruction_num)
+        for reg in self.BYTE_REGISTERS:
+            getattr(self, reg).append(getattr(state, reg))
+        self.sp.append(state.sp)
+        self.pc.append(state.pc)
+        if self.memory is not None:
+            self.memory.append(int.from_bytes(state.memory, 'big'))
+    
+    @classmethod
+    def from_records(cls, records: bytes, skip_memory: bool = False) -> 'Trace':
+        """Build a trace from packed 16-byte records.
+        
+        Each record holds A, F, B, C, D, E, H, L, SP (big-endian), PC
+        (big-endian) and the four memory bytes. Columns are split out with
+        strided slices, so no per-instruction Python work is done here.
+        """
+        trace = cls(skip_memory)
+        for i, reg in enumerate(cls.BYTE_REGISTERS):
+            setattr(trace, reg, array('B', records[i::16]))
+        trace.sp = _be_column(records, 8, 2, 'H')
+        trace.pc = _be_column(records, 10, 2, 'H')
+        if not skip_memory:
+            trace.memory = _be_column(records, 12, 4, 'I')
+        trace.instruction_nums = array('q', range(len(records) // 16))
+        return trace
+    
+    def diff_indices(self, other: 'Trace', n: int) -> Iterator[int]:
+        """Yield, in order, the indices below n where the two traces differ.
+        
+        With numpy the columns are compared as whole vectors. Otherwise they
+        are compared a block at a time, and only blocks that differ are
+        walked row by row.
+        """
+        pairs = [(getattr(self, name), getattr(other, name)) for name in self.COLUMNS]
+        # Memory is only compared when both traces kept it
+        pairs = [(col1, col2) for col1, col2 in pairs if col1 is not None and col2 is not None]
+        
+        if np is not None:
+            any_diff = np.zeros(n, dtype=np.bool_)
+            for col1, col2 in pairs:
+                any_diff |= np.frombuffer(col1, dtype=col1.typecode)[:n] != np.frombuffer(col2, dtype=col2.typecode)[:n]
+            yield from np.flatnonzero(any_diff).tolist()
+            return
+        
+        for start in range(0, n, _DIFF_BLOCK):
+            end = min(start + _DIFF_BLOCK, n)
+            blocks1 = [col1[start:end] for col1, _ in pairs]
+            blocks2 = [col2[start:end] for _, col2 in pairs]
+            if blocks1 == blocks2:
+                continue
+            for i, row1, row2 in zip(count(start), zip(*blocks1), zip(*blocks2)):
+                if row1 != row2:
+                    yield i
+    
+    @classmethod
+    def from_states(cls, states: Iterable[CPUState], skip_memory: bool = False) -> 'Trace':
+        """Build a trace from a sequence of CPUStates."""
+        trace = cls(skip_memory)
+        for state in states:
+            trace.append(state)
+        return trace
+
+
+def _decode_standard_range(filename: str, start: int, end: int, skip_memory: bool = False) -> bytes:
+    """Worker entry point: decode the standard lines in bytes [start, end) of a file."""
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return bytes(TraceParser.decode_standard_buffer(mm[start:end], skip_memory))
+
+
+def _be_column(records: bytes, offset: int, width: int, typecode: str) -> array:
+    """Gather a big-endian field out of packed records into a native array."""
+    n = len(records) // 16
+    raw = bytearray(n * width)
+    for k in range(width):
+        raw[k::width] = records[offset + k::16]
+    column = array(typecode, raw)
+    if sys.byteorder == 'little':
+        column.byteswap()
+    return column
 
 
 class TraceParser:
     """Parses both standard and JSON format traces."""
     
     @staticmethod
-    def parse_standard_line(line: str, instruction_num: int) -> Optional[CPUState]:
+    def parse_standard_line(line: str, instruction_num: int, skip_memory: bool = False) -> Optional[CPUState]:
         """Parse a standard format trace line."""
-        # Format: A: 01 F: B0 B: 00 C: 13 D: 00 E: D8 H: 01 L: 4D SP: FFFE PC: 00:0100 (00 C3 13 02)
-        pattern = r'A: ([0-9A-F]{2}) F: ([0-9A-F]{2}) B: ([0-9A-F]{2}) C: ([0-9A-F]{2}) D: ([0-9A-F]{2}) E: ([0-9A-F]{2}) H: ([0-9A-F]{2}) L: ([0-9A-F]{2}) SP: ([0-9A-F]{4}) PC: 00:([0-9A-F]{4}) \(([0-9A-F]{2}) ([0-9A-F]{2}) ([0-9A-F]{2}) ([0-9A-F]{2})\)'
-        
-        match = re.match(pattern, line.strip())
+        # Every field sits at a fixed column, so well-formed lines are sliced
+        # directly. Re-rendering the decoded values and comparing against the
+        # line accepts exactly what _STD_RE accepts (uppercase hex, bank 00,
+        # literal separators, no signs); anything else falls through to the regex.
+        if line.startswith('A: '):
+            try:
+                registers = (
+                    int(line[3:5], 16), int(line[9:11], 16), int(line[15:17], 16), int(line[21:23], 16),
+                    int(line[27:29], 16), int(line[33:35], 16), int(line[39:41], 16), int(line[45:47], 16),
+                    int(line[52:56], 16), int(line[64:68], 16)
+                )
+            except ValueError:
+                registers = None
+            if (registers is not None and min(registers) >= 0 and
+                    _STD_REG_FORMAT % registers == line[:_STD_REG_LEN]):
+                if skip_memory:
+                    # Only validate the memory field; its bytes are not needed
+                    if _STD_MEM_RE.fullmatch(line, _STD_REG_LEN, _STD_LINE_LEN):
+                        return CPUState(instruction_num, *registers, memory=None)
+                else:
+                    try:
+                        memory = bytes.fromhex(line[70:81])
+                    except ValueError:
+                        memory = None
+                    if (memory is not None and len(memory) == 4 and
+                            _STD_MEM_FORMAT % tuple(memory) == line[_STD_REG_LEN:_STD_LINE_LEN]):
+                        return CPUState(instruction_num, *registers, memory=memory)
+
+        # Anything else (leading whitespace, noise) goes through the regex
+        match = _STD_RE.match(line.strip())
         if not match:
             return None
             
-        groups = match.groups()
+        return TraceParser.state_from_groups(instruction_num, match.groups(), skip_memory)
+    
+    @staticmethod
+    def state_from_groups(instruction_num: int, groups: Tuple[str, ...], skip_memory: bool = False) -> CPUState:
+        """Build a CPUState from the hex fields captured by _STD_PATTERN."""
         return CPUState(
-            instruction_num=instruction_num,
-            a=groups[0], f=groups[1], b=groups[2], c=groups[3],
-            d=groups[4], e=groups[5], h=groups[6], l=groups[7],
-            sp=groups[8], pc=groups[9],
-            memory=[groups[10], groups[11], groups[12], groups[13]]
+            instruction_num,
+            *[int(value, 16) for value in groups[:10]],
+            memory=None if skip_memory else bytes.fromhex(''.join(groups[10:14]))
         )
     
     @staticmethod
-    def parse_json_file(filename: str) -> List[CPUState]:
-        """Parse a JSON format trace file."""
-        with open(filename, 'r') as f:
-            data = json.load(f)
-        
-        states = []
-        for entry in data:
+    def iter_json_entries(entries: Iterable, skip_memory: bool = False) -> Iterator[CPUState]:
+        """Build CPU states from decoded JSON trace entries as they arrive."""
+        for entry in entries:
             if isinstance(entry, dict):
-                states.append(CPUState(
+                yield CPUState(
                     instruction_num=entry["instruction"],
-                    a=entry["A"], f=entry["F"], b=entry["B"], c=entry["C"],
-                    d=entry["D"], e=entry["E"], h=entry["H"], l=entry["L"],
-                    sp=entry["SP"], pc=entry["PC"],
-                    memory=entry["memory"]
-                ))
-        return states
+                    a=int(entry["A"], 16), f=int(entry["F"], 16), b=int(entry["B"], 16), c=int(entry["C"], 16),
+                    d=int(entry["D"], 16), e=int(entry["E"], 16), h=int(entry["H"], 16), l=int(entry["L"], 16),
+                    sp=int(entry["SP"], 16), pc=int(entry["PC"], 16),
+                    memory=None if skip_memory else bytes.fromhex(''.join(entry["memory"]))
+                )
+    
+    @staticmethod
+    def parse_json_file(filename: str, skip_memory: bool = False) -> List[CPUState]:
+        """Parse a JSON format trace file."""
+        return list(TraceParser.parse_json_iter(filename, skip_memory, _JSON_STREAM_THRESHOLD))
+    
+    @staticmethod
+    def parse_json_iter(filename: str, skip_memory: bool = False,
+                        stream_threshold: int = 0) -> Iterator[CPUState]:
+        """Yield the states of a JSON format trace file one at a time.
+        
+        Files larger than stream_threshold are streamed with ijson when it is
+        installed; otherwise the file is decoded whole and only the CPUStates
+        are produced lazily.
+        """
+        with open(filename, 'rb') as f:
+            if ijson is not None and os.fstat(f.fileno()).st_size > stream_threshold:
+                # Stream entries so the full list of dicts is never held in memory
+                yield from TraceParser.iter_json_entries(ijson.items(f, 'item'), skip_memory)
+                return
+            raw = f.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        yield from TraceParser.iter_json_entries(data, skip_memory)
     
     @staticmethod
-    def parse_standard_file(filename: str) -> List[CPUState]:
-        """Parse a standard format trace file."""
-        states = []
+    def parse_standard_iter(filename: str, skip_memory: bool = False) -> Iterator[CPUState]:
+        """Yield the states of a standard format trace file one line at a time."""
+        instruction_num = 0
         with open(filename, 'r') as f:
-            for i, line in enumerate(f):
-                state = TraceParser.parse_standard_line(line, i)
+            for line in f:
+                state = TraceParser.parse_standard_line(line, instruction_num, skip_memory)
                 if state:
-                    states.append(state)
-        return states
+                    yield state
+                    instruction_num += 1
     
     @staticmethod
-    def parse_file(filename: str) -> List[CPUState]:
+    def parse_standard_file(filename: str, skip_memory: bool = False) -> List[CPUState]:
+        """Parse a standard format trace file into a list of CPUStates.
+        
+        Kept for callers that want CPUState objects; the file is mapped and
+        decoded by parse_standard_file_soa rather than read as text.
+        """
+        trace = TraceParser.parse_standard_file_soa(filename, skip_memory)
+        return [trace[i] for i in range(len(trace))]
+    
+    @staticmethod
+    def parse_standard_file_soa(filename: str, skip_memory: bool = False,
+                                pool: Optional[ProcessPoolExecutor] = None) -> Trace:
+        """Parse a standard format trace file straight into column storage.
+        
+        Large files are decoded on pool when given, else on a pool of their own.
+        """
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return Trace(skip_memory)
+            # Map the file rather than reading it; the decoders work on the
+            # mapped bytes directly and return their own copy of the records
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                workers = os.cpu_count() or 1
+                if workers > 1 and len(mm) >= _PARALLEL_PARSE_THRESHOLD and not _jit_decodes(len(mm)):
+                    records = TraceParser.decode_standard_parallel(filename, mm, workers, pool, skip_memory)
+                else:
+                    records = TraceParser.decode_standard_buffer(mm, skip_memory)
+        
+        return Trace.from_records(records, skip_memory)
+    
+    @staticmethod
+    def decode_standard_parallel(filename: str, mm: mmap.mmap, workers: int,
+                                 pool: Optional[ProcessPoolExecutor] = None,
+                                 skip_memory: bool = False) -> bytes:
+        """Decode a mapped standard trace in line-aligned chunks across processes."""
+        if pool is None:
+            with TraceParser.process_pool(workers) as pool:
+                return TraceParser.decode_standard_parallel(filename, mm, workers, pool, skip_memory)
+        
+        bounds = [0]
+        for k in range(1, workers):
+            newline = mm.find(b'\n', max(bounds[-1], len(mm) * k // workers))
+            if newline < 0:
+                break
+            bounds.append(newline + 1)
+        bounds.append(len(mm))
+        
+        n = len(bounds) - 1
+        chunks = pool.map(_decode_standard_range, [filename] * n, bounds[:-1], bounds[1:], [skip_memory] * n)
+        return b''.join(chunks)
+    
+    @staticmethod
+    def process_pool(workers: int) -> ProcessPoolExecutor:
+        """Create a worker pool for decode_standard_parallel."""
+        # spawn rather than fork: the pool may be used from main()'s threads
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    
+    @staticmethod
+    def decode_standard_buffer(buf: Union[bytes, mmap.mmap], skip_memory: bool = False) -> bytes:
+        """Decode every standard format line in buf into packed 16-byte records.
+        
+        With skip_memory the memory bytes are still validated but not decoded;
+        they are left zero in the records.
+        """
+        if _jit_decodes(len(buf)):
+            data = np.frombuffer(buf, dtype=np.uint8)
+            line_starts = np.concatenate(([0], np.flatnonzero(data == ord('\n')) + 1))
+            offsets = _HEX_OFFSETS[:12] if skip_memory else _HEX_OFFSETS
+            records, valid = _std_decoder()(data, line_starts, _STD_TEMPLATE, _NIBBLE, offsets)
+            return records[valid].tobytes()
+        
+        # The regex only locates valid lines; each one is then decoded at
+        # fixed offsets through the hex lookup table
+        hex2 = _HEX2.__getitem__
+        records = bytearray()
+        if skip_memory:
+            unpack = _STD_REG_WORDS.unpack_from
+            for match in _STD_BYTES_RE.finditer(buf):
+                records += bytes(map(hex2, unpack(buf, match.end() - _STD_LINE_LEN)))
+                records += _ZERO_MEMORY
+            return records
+        
+        unpack = _STD_WORDS.unpack_from
+        for match in _STD_BYTES_RE.finditer(buf):
+            records += bytes(map(hex2, unpack(buf, match.end() - _STD_LINE_LEN)))
+        return records
+    
+    @staticmethod
+    def is_json_file(filename: str) -> bool:
+        """Sniff the first non-whitespace byte: JSON traces open with '[' or '{'."""
+        with open(filename, 'rb') as f:
+            while True:
+                chunk = f.read(64)
+                if not chunk:
+                    return False
+                head = chunk.lstrip()
+                if head:
+                    return head[:1] in (b'[', b'{')
+    
+    @staticmethod
+    def parse_file(filename: str, skip_memory: bool = False,
+                   pool: Optional[ProcessPoolExecutor] = None) -> Trace:
         """Auto-detect format and parse trace file."""
-        try:
-            # Try JSON first
-            return TraceParser.parse_json_file(filename)
-        except (json.JSONDecodeError, KeyError):
-            # Fall back to standard format
-            return TraceParser.parse_standard_file(filename)
+        if TraceParser.is_json_file(filename):
+            # States go straight into the columns; no intermediate list is built
+            states = TraceParser.parse_json_iter(filename, skip_memory, _JSON_STREAM_THRESHOLD)
+            return Trace.from_states(states, skip_memory)
+        return TraceParser.parse_standard_file_soa(filename, skip_memory, pool)
+    
+    @staticmethod
+    def iter_file(filename: str, skip_memory: bool = False) -> Iterator[CPUState]:
+        """Auto-detect format and yield the states of a trace file lazily."""
+        if TraceParser.is_json_file(filename):
+            return TraceParser.parse_json_iter(filename, skip_memory)
+        return TraceParser.parse_standard_iter(filename, skip_memory)
+
+
+def _reported_instructions(diff_indices: Iterator[int], n: int,
+                           show_matching: bool) -> Iterator[Tuple[int, bool]]:
+    """Yield (index, has_diff) for each instruction that should be printed."""
+    if not show_matching:
+        for i in diff_indices:
+            yield i, True
+        return
+    
+    next_diff = next(diff_indices, None)
+    for i in range(n):
+        if i == next_diff:
+            next_diff = next(diff_indices, None)
+            yield i, True
+        else:
+            yield i, False
 
 
 class TraceDiffer:
@@ -115,17 +562,33 @@ class TraceDiffer:
             'reset': '\033[0m',
             'bold': '\033[1m'
         } if colorize else {k: '' for k in ['red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'reset', 'bold']}
+        
+        # Pre-colored "old -> new" templates for each register and memory
+        red, green, reset = self.colors['red'], self.colors['green'], self.colors['reset']
+        self._reg_templates = {
+            name: f"{name}: {red}{{0:{fmt}}}{reset} -> {green}{{1:{fmt}}}{reset}"
+            for name, fmt in [('A', '02X'), ('F', '02X'), ('B', '02X'), ('C', '02X'), ('D', '02X'),
+                              ('E', '02X'), ('H', '02X'), ('L', '02X'), ('SP', '04X'), ('PC', '04X')]
+        }
+        self._mem_template = f"MEM: ({red}{{0}}{reset}) -> ({green}{{1}}{reset})"
     
     def colorize_text(self, text: str, color: str) -> str:
         """Apply color to text if colorization is enabled."""
         return f"{self.colors[color]}{text}{self.colors['reset']}"
     
-    def compare_states(self, state1: CPUState, state2: CPUState) -> Tuple[bool, List[str]]:
+    def compare_states(self, state1: CPUState, state2: CPUState) -> Tuple[bool, Sequence[str]]:
         """Compare two CPU states and return differences."""
+        # Fast path: one tuple comparison covers every register and memory
+        if ((state1.a, state1.f, state1.b, state1.c, state1.d, state1.e, state1.h, state1.l,
+             state1.sp, state1.pc, state1.memory) ==
+                (state2.a, state2.f, state2.b, state2.c, state2.d, state2.e, state2.h, state2.l,
+                 state2.sp, state2.pc, state2.memory)):
+            return False, _NO_DIFFERENCES
+        
         differences = []
         has_differences = False
         
-        # Compare registers
+        # Compare registers as integers; only differing values are formatted
         registers = [
             ('A', state1.a, state2.a),
             ('F', state1.f, state2.f),
@@ -142,23 +605,29 @@ class TraceDiffer:
         for reg_name, val1, val2 in registers:
             if val1 != val2:
                 has_differences = True
-                diff_text = f"{reg_name}: {self.colorize_text(val1, 'red')} -> {self.colorize_text(val2, 'green')}"
-                differences.append(diff_text)
+                differences.append(self._reg_templates[reg_name].format(val1, val2))
         
-        # Compare memory
-        if state1.memory != state2.memory:
+        # Compare memory, unless either side was parsed without it
+        if state1.memory is not None and state2.memory is not None and state1.memory != state2.memory:
             has_differences = True
-            mem1_str = ' '.join(state1.memory)
-            mem2_str = ' '.join(state2.memory)
-            diff_text = f"MEM: ({self.colorize_text(mem1_str, 'red')}) -> ({self.colorize_text(mem2_str, 'green')})"
-            differences.append(diff_text)
+            mem1_str = state1.memory.hex(' ').upper()
+            mem2_str = state2.memory.hex(' ').upper()
+            differences.append(self._mem_template.format(mem1_str, mem2_str))
         
         return has_differences, differences
     
-    def compare_traces(self, trace1: List[CPUState], trace2: List[CPUState], 
+    def compare_traces(self, trace1: Union[Trace, List[CPUState]], trace2: Union[Trace, List[CPUState]], 
                       max_lines: Optional[int] = None, show_matching: bool = False,
                       limit_comparison: Optional[int] = None) -> None:
         """Compare two traces and output differences."""
+        if not isinstance(trace1, Trace):
+            trace1 = Trace.from_states(trace1, bool(trace1) and trace1[0].memory is None)
+        if not isinstance(trace2, Trace):
+            trace2 = Trace.from_states(trace2, bool(trace2) and trace2[0].memory is None)
+        
+        # Output is collected and written once, not printed line by line
+        out: List[str] = []
+        
         min_len = min(len(trace1), len(trace2))
         max_len = max(len(trace1), len(trace2))
         
@@ -169,59 +638,156 @@ class TraceDiffer:
             max_len = min(max_len, limit_comparison)
             
             if limit_comparison < original_max_len:
-                print(f"{self.colorize_text('INFO:', 'cyan')} Limiting comparison to first {limit_comparison} instructions")
-                print()
+                out.append(f"{self.colorize_text('INFO:', 'cyan')} Limiting comparison to first {limit_comparison} instructions\n")
+                out.append("\n")
         
         if len(trace1) != len(trace2):
-            print(f"{self.colorize_text('WARNING:', 'yellow')} Trace lengths differ: {len(trace1)} vs {len(trace2)}")
-            print()
+            out.append(f"{self.colorize_text('WARNING:', 'yellow')} Trace lengths differ: {len(trace1)} vs {len(trace2)}\n")
+            out.append("\n")
         
         differences_found = 0
         lines_processed = 0
         
-        for i in range(min_len):
+        # Differing instructions are located up front; CPUStates are only
+        # rebuilt for the instructions that actually get printed
+        diff_indices = trace1.diff_indices(trace2, min_len)
+        for i, has_diff in _reported_instructions(diff_indices, min_len, show_matching):
             if max_lines and lines_processed >= max_lines:
                 break
-                
-            state1, state2 = trace1[i], trace2[i]
-            has_diff, diffs = self.compare_states(state1, state2)
+            lines_processed += 1
             
-            if has_diff or show_matching:
-                lines_processed += 1
-                
-                if has_diff:
-                    differences_found += 1
-                    print(f"{self.colorize_text(f'DIFF at instruction {i}:', 'bold')}")
-                    for diff in diffs:
-                        print(f"  {diff}")
-                    print()
-                elif show_matching:
-                    print(f"{self.colorize_text(f'MATCH at instruction {i}:', 'blue')} PC: {state1.pc}")
+            if has_diff:
+                differences_found += 1
+                _, diffs = self.compare_states(trace1[i], trace2[i])
+                self.format_diff(out, i, diffs)
+            else:
+                self.format_match(out, i, trace1.pc[i])
         
         # Handle extra lines in longer trace
         if min_len < max_len:
             longer_trace = trace1 if len(trace1) > len(trace2) else trace2
             trace_name = "trace1" if len(trace1) > len(trace2) else "trace2"
             
-            print(f"{self.colorize_text(f'Extra lines in {trace_name}:', 'yellow')}")
-            for i in range(min_len, min(max_len, min_len + 10)):  # Show up to 10 extra lines
-                state = longer_trace[i]
-                print(f"  Instruction {i}: PC: {state.pc}")
+            # Show up to 10 extra lines
+            extra = [(i, longer_trace.pc[i]) for i in range(min_len, min(max_len, min_len + 10))]
+            self.format_extra_lines(out, trace_name, extra, max(0, max_len - min_len - 10))
+        
+        self.format_summary(out, min(lines_processed, min_len), differences_found, len(trace1) == len(trace2))
+        sys.stdout.write(''.join(out))
+    
+    def compare_traces_streaming(self, states1: Iterable[CPUState], states2: Iterable[CPUState],
+                                 max_lines: Optional[int] = None, show_matching: bool = False,
+                                 limit_comparison: Optional[int] = None) -> None:
+        """Compare two traces pair by pair as their states are produced.
+        
+        Only the current pair of states is held, so memory use does not grow
+        with trace length. Lengths are only known once a trace runs out, so a
+        length mismatch is reported after the differences rather than before.
+        """
+        # Output is written in batches so it stays bounded on long traces
+        out: List[str] = []
+        raw1, raw2 = iter(states1), iter(states2)
+        if limit_comparison is not None:
+            states1 = islice(raw1, limit_comparison)
+            states2 = islice(raw2, limit_comparison)
+        else:
+            states1, states2 = raw1, raw2
+        
+        differences_found = 0
+        lines_processed = 0
+        compared = 0
+        leftover = None
+        stopped_early = False
+        
+        for state1, state2 in zip_longest(states1, states2):
+            if state1 is None or state2 is None:
+                leftover = ("trace1", state1, states1) if state2 is None else ("trace2", state2, states2)
+                break
+            if max_lines and lines_processed >= max_lines:
+                stopped_early = True
+                break
             
-            if max_len > min_len + 10:
-                print(f"  ... and {max_len - min_len - 10} more lines")
-            print()
+            has_diff, diffs = self.compare_states(state1, state2)
+            if has_diff:
+                lines_processed += 1
+                differences_found += 1
+                self.format_diff(out, compared, diffs)
+            elif show_matching:
+                lines_processed += 1
+                self.format_match(out, compared, state1.pc)
+            compared += 1
+            
+            if len(out) >= _OUTPUT_FLUSH_LINES:
+                sys.stdout.write(''.join(out))
+                out.clear()
+        
+        if leftover is not None:
+            trace_name, first, rest = leftover
+            # Show up to 10 extra lines, then just count the remainder
+            extra = [(compared, first.pc)]
+            extra.extend((compared + k, state.pc) for k, state in enumerate(islice(rest, 9), 1))
+            remaining = sum(1 for _ in rest)
+        
+        # Probe past the limit: the islice views cannot see how long the
+        # traces really are, and only a trace that stops within it is known
+        beyond1 = beyond2 = False
+        if limit_comparison is not None and not stopped_early:
+            beyond1 = next(raw1, None) is not None
+            beyond2 = next(raw2, None) is not None
+            if beyond1 or beyond2:
+                out.append(f"{self.colorize_text('INFO:', 'cyan')} Limiting comparison to first {limit_comparison} instructions\n")
+                out.append("\n")
+        
+        if leftover is not None:
+            longer_len = compared + len(extra) + remaining
+            longer_text = f"more than {longer_len}" if beyond1 or beyond2 else str(longer_len)
+            lengths = (longer_text, compared) if trace_name == "trace1" else (compared, longer_text)
+            out.append(f"{self.colorize_text('WARNING:', 'yellow')} Trace lengths differ: {lengths[0]} vs {lengths[1]}\n")
+            out.append("\n")
+            self.format_extra_lines(out, trace_name, extra, remaining)
+        elif beyond1 != beyond2:
+            trace_name = "trace1" if beyond1 else "trace2"
+            out.append(f"{self.colorize_text('WARNING:', 'yellow')} Trace lengths differ: "
+                       f"{trace_name} continues past the first {limit_comparison} instructions\n")
+            out.append("\n")
+        
+        # When both traces run past the limit their full lengths are unknown,
+        # so they are never reported as identical
+        same_length = leftover is None and not stopped_early and not (beyond1 or beyond2)
+        self.format_summary(out, min(lines_processed, compared), differences_found, same_length)
+        sys.stdout.write(''.join(out))
+    
+    def format_diff(self, out: List[str], i: int, diffs: Sequence[str]) -> None:
+        """Append the differences found at one instruction to out."""
+        out.append(f"{self.colorize_text(f'DIFF at instruction {i}:', 'bold')}\n")
+        for diff in diffs:
+            out.append(f"  {diff}\n")
+        out.append("\n")
+    
+    def format_match(self, out: List[str], i: int, pc: int) -> None:
+        """Append a matching instruction to out."""
+        out.append(f"{self.colorize_text(f'MATCH at instruction {i}:', 'blue')} PC: {pc:04X}\n")
+    
+    def format_extra_lines(self, out: List[str], trace_name: str, extra: List[Tuple[int, int]], remaining: int) -> None:
+        """Append the (index, PC) pairs only present in the longer trace to out."""
+        out.append(f"{self.colorize_text(f'Extra lines in {trace_name}:', 'yellow')}\n")
+        for i, pc in extra:
+            out.append(f"  Instruction {i}: PC: {pc:04X}\n")
         
-        # Summary
-        total_compared = min(lines_processed, min_len)
-        print(f"{self.colorize_text('SUMMARY:', 'bold')}")
-        print(f"  Instructions compared: {total_compared}")
-        print(f"  Differences found: {self.colorize_text(str(differences_found), 'red' if differences_found > 0 else 'green')}")
+        if remaining > 0:
+            out.append(f"  ... and {remaining} more lines\n")
+        out.append("\n")
+    
+    def format_summary(self, out: List[str], total_compared: int, differences_found: int, same_length: bool) -> None:
+        """Append the closing summary to out."""
+        out.append(f"{self.colorize_text('SUMMARY:', 'bold')}\n")
+        out.append(f"  Instructions compared: {total_compared}\n")
+        out.append(f"  Differences found: {self.colorize_text(str(differences_found), 'red' if differences_found > 0 else 'green')}\n")
         
-        if differences_found == 0 and len(trace1) == len(trace2):
-            print(f"  {self.colorize_text('✓ Traces are identical!', 'green')}")
+        if differences_found == 0 and same_length:
+            out.append(f"  {self.colorize_text('✓ Traces are identical!', 'green')}\n")
         elif differences_found == 0:
-            print(f"  {self.colorize_text('✓ No differences in compared instructions', 'green')}")
+            out.append(f"  {self.colorize_text('✓ No differences in compared instructions', 'green')}\n")
 
 
 def main():
@@ -234,6 +800,7 @@ Examples:
   python trace_diff.py trace1.json trace2.json --no-color
   python trace_diff.py trace1.txt trace2.txt --max-lines 50 --show-matching
   python trace_diff.py trace1.txt trace2.txt --limit-comparison 1000
+  python trace_diff.py trace1.txt trace2.txt --stream
         """
     )
     
@@ -243,20 +810,49 @@ Examples:
     parser.add_argument('--max-lines', type=int, help='Maximum number of differences to show')
     parser.add_argument('--show-matching', action='store_true', help='Show matching instructions too')
     parser.add_argument('--limit-comparison', type=int, help='Only compare the first N instructions')
+    parser.add_argument('--stream', action='store_true',
+                        help='Compare while parsing instead of loading both traces (constant memory)')
+    parser.add_argument('--skip-memory', action='store_true',
+                        help='Ignore the memory bytes; parse and compare registers only')
     
     args = parser.parse_args()
     
     try:
-        print(f"Loading {args.trace1}...")
-        trace1 = TraceParser.parse_file(args.trace1)
+        differ = TraceDiffer(colorize=not args.no_color)
         
-        print(f"Loading {args.trace2}...")
-        trace2 = TraceParser.parse_file(args.trace2)
+        if args.stream:
+            print(f"Streaming {args.trace1} and {args.trace2}...")
+            print()
+            differ.compare_traces_streaming(TraceParser.iter_file(args.trace1, args.skip_memory),
+                                            TraceParser.iter_file(args.trace2, args.skip_memory),
+                                            args.max_lines, args.show_matching, args.limit_comparison)
+            return
+        
+        jit = any(not TraceParser.is_json_file(name) and _jit_decodes(os.path.getsize(name))
+                  for name in (args.trace1, args.trace2))
+        if not jit:
+            # Load both traces at once so their I/O and worker processes overlap
+            print(f"Loading {args.trace1}...")
+            print(f"Loading {args.trace2}...")
+            # One process pool serves both files so there are never more
+            # decoder processes than cores; workers only start when needed
+            with TraceParser.process_pool(os.cpu_count() or 1) as processes, \
+                    ThreadPoolExecutor(max_workers=2) as threads:
+                future1 = threads.submit(TraceParser.parse_file, args.trace1, args.skip_memory, processes)
+                future2 = threads.submit(TraceParser.parse_file, args.trace2, args.skip_memory, processes)
+                trace1, trace2 = future1.result(), future2.result()
+        else:
+            # The numba kernel already uses every core, and its thread pool
+            # hangs interpreter exit if first started off the main thread
+            print(f"Loading {args.trace1}...")
+            trace1 = TraceParser.parse_file(args.trace1, args.skip_memory)
+            
+            print(f"Loading {args.trace2}...")
+            trace2 = TraceParser.parse_file(args.trace2, args.skip_memory)
         
         print(f"Loaded {len(trace1)} and {len(trace2)} instructions respectively.")
         print()
         
-        differ = TraceDiffer(colorize=not args.no_color)
         differ.compare_traces(trace1, trace2, args.max_lines, args.show_matching, args.limit_comparison)
         
     except FileNotFoundError as e: